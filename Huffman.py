@@ -1,13 +1,29 @@
-import pickle  # 序列化库
+import heapq
+import mmap
+import struct
 import sys
+from array import array
+from contextlib import contextmanager
+
+import numpy as np
+from PyQt5.QtCore import QObject, Qt, QThread, pyqtSignal
 from PyQt5.QtGui import QIcon, QPixmap
 from PyQt5.QtWidgets import QApplication, QComboBox, QFileDialog, QLabel, QMessageBox, QProgressBar, QPushButton, \
     QLineEdit, QVBoxLayout, QWidget, QHBoxLayout
 
+try:
+    from numba import njit  # 可选依赖，用于即时编译编解码循环
+except ImportError:
+    def njit(**kwargs):
+        """未安装numba时不编译，直接使用Python函数"""
+        return lambda f: f
+
 
 class Node:
     """节点类"""
 
+    __slots__ = ('character', 'weight', 'left', 'right', 'is_leaf')  # 不为每个节点分配__dict__
+
     def __init__(self, character: int, weight: int):
         """用字符（字节）及其权值（频次）构造节点"""
         self.character = character
@@ -18,6 +34,8 @@ class Node:
         """左子节点"""
         self.right = None
         """右子节点"""
+        self.is_leaf = True
+        """是否为叶节点，合并时设为False"""
 
     @staticmethod
     def merge(left, right):
@@ -25,156 +43,349 @@ class Node:
         node = Node(0, left.weight + right.weight)
         node.left = left
         node.right = right
+        node.is_leaf = False
         return node
 
-    def is_leaf(self):
-        """判断节点是否为叶节点"""
-        return self.left is None
-
-
-class Tree:
-    """树类"""
-
-    def __init__(self, root: Node):
-        """构造一棵树"""
-        self.root = root
-        """根节点"""
-        self.weight = root.weight
-        """根节点的权值"""
-
-    @staticmethod
-    def merge(left, right):
-        """将两棵树合并为新树"""
-        return Tree(Node.merge(left.root, right.root))
-
 
-class HuffmanTree(Tree):
+class HuffmanTree:
     """Huffman树类"""
 
     def __init__(self, dic: dict):
         """以字符（字节）及对应的权值（频次）构造Huffman树"""
-        self.codes = {}
-        """字符（字节）及对应的Huffman编码"""
-        # 以每个字符及其频次构建一颗无子节点的树，加入树林
-        trees = [Tree(Node(i, dic[i])) for i in dic]
-        # 对树林以权值升序排列，从而减少后续插入的操作次数
-        trees.sort(key=lambda x: x.weight)
-        # 合并权值最小的两颗树，直到只剩下一棵树
-        while len(trees) > 1:
-            tree = Tree.merge(trees[0], trees[1])
-            trees.pop(0)
-            trees.pop(0)
-            HuffmanTree.__add_tree(trees, tree)
-        super().__init__(trees[0].root)
+        # 以每个字符及其频次构建一个叶节点，加入优先队列；序号用于权值相同时比较，避免比较节点
+        heap = [(dic[c], i, Node(c, dic[c])) for i, c in enumerate(dic)]
+        heapq.heapify(heap)
+        count = len(heap)
+        # 合并权值最小的两个节点，直到只剩下一个节点
+        while len(heap) > 1:
+            w1, _, left = heapq.heappop(heap)
+            w2, _, right = heapq.heappop(heap)
+            heapq.heappush(heap, (w1 + w2, count, Node.merge(left, right)))
+            count += 1
+        self.root = heap[0][2]
+        """根节点"""
+        self.code_len = array('B', bytes(256))
+        """以字节为下标的编码长度，未出现的字节为0"""
         # 如果只有一个节点，即只有一种字节，则将其编码为“0”
-        if self.root.is_leaf():
-            self.codes[self.root.character] = '0'
+        if self.root.is_leaf:
+            self.code_len[self.root.character] = 1
         else:
-            self.__generate_code(self.root, '')  # 递归编码
-
-    @staticmethod
-    def __add_tree(trees, tree: Tree):
-        """将树插入树林"""
-        i = 0
-        while i < len(trees):
-            if tree.weight <= trees[i].weight:
-                break
-            i += 1
-        trees.insert(i, tree)
-
-    def __generate_code(self, root: Node, code: str):
-        """递归生成Huffman编码"""
-        # 如果是叶节点，则编码就是code
-        if root.is_leaf():
-            self.codes[root.character] = code
-        # 如果不是叶节点，分别以code||0和code||1为前缀生成子节点的编码
+            self.__generate_code(self.root, 0)  # 递归求编码长度
+        self.code_val = canonical_codes(self.code_len)
+        """以字节为下标的范式Huffman编码值，与code_len一起用于编码"""
+
+    @property
+    def codes(self):
+        """字符（字节）及对应的Huffman编码字符串"""
+        return {i: format(self.code_val[i], f'0{self.code_len[i]}b') for i in range(256) if self.code_len[i] > 0}
+
+    def __generate_code(self, root: Node, depth: int):
+        """递归生成各字节的编码长度，即叶节点的深度"""
+        if root.is_leaf:
+            self.code_len[root.character] = depth
         else:
-            self.__generate_code(root.left, code + '0')
-            self.__generate_code(root.right, code + '1')
+            self.__generate_code(root.left, depth + 1)
+            self.__generate_code(root.right, depth + 1)
+
+
+def canonical_codes(code_len):
+    """由各字节的编码长度生成范式Huffman编码，按（编码长度, 字节）升序依次分配，返回各字节的编码值"""
+    code_val = array('q', bytes(8 * 256))
+    code = 0
+    prev_len = 0
+    for length, i in sorted((length, i) for i, length in enumerate(code_len) if length > 0):
+        code <<= length - prev_len
+        code_val[i] = code
+        code += 1
+        prev_len = length
+    return code_val
+
+
+def build_flat(code_val, code_len):
+    """将编码插入一棵树，并展开为左子节点、右子节点、字节三个数组，根节点下标为0，叶节点的子节点下标为-1"""
+    left = array('i', [-1])
+    right = array('i', [-1])
+    symbol = array('B', [0])
+    for i in range(256):
+        node = 0
+        # 从高位到低位，0走左子树，1走右子树，缺少的节点新建
+        for n in range(code_len[i] - 1, -1, -1):
+            links = right if (code_val[i] >> n) & 1 else left
+            if links[node] < 0:
+                links[node] = len(symbol)
+                left.append(-1)
+                right.append(-1)
+                symbol.append(0)
+            node = links[node]
+        if code_len[i] > 0:
+            symbol[node] = i
+    return left, right, symbol
+
+
+@njit(cache=True, boundscheck=False)
+def _encode_kernel(data, code_val, code_len, out, out_pos: int, acc: int, nbits: int):
+    """将data编码写入out[out_pos:]，返回（out中的位置, 位缓冲区, 位缓冲区中的比特数）"""
+    for i in data:
+        acc = (acc << code_len[i]) | code_val[i]
+        nbits += code_len[i]
+        while nbits >= 8:
+            nbits -= 8
+            out[out_pos] = (acc >> nbits) & 0xFF
+            out_pos += 1
+        acc &= (1 << nbits) - 1  # 丢弃已写出的比特
+    return out_pos, acc, nbits
+
+
+@njit(cache=True, boundscheck=False)
+def _decode_kernel(data, pos: int, table_sym, table_len, left, right, symbol, max_len: int, out, out_pos: int, end: int,
+                   acc: int, nbits: int):
+    """从data[pos:]解码到out[out_pos:end]，数据读完时提前返回，
+    返回（data中的位置, out中的位置, 位缓冲区, 位缓冲区中的比特数）"""
+    while out_pos < end:
+        # 保证缓冲区中至少有一个最长编码的比特数，一次补充尽可能多的字节，最多保留63位
+        if nbits < max_len:
+            if pos == len(data):
+                break
+            acc &= (1 << nbits) - 1  # 丢弃已解压的比特
+            while nbits <= 55 and pos < len(data):
+                acc = (acc << 8) | data[pos]
+                pos += 1
+                nbits += 8
+            continue
+        i = (acc >> (nbits - 8)) & 0xFF
+        if table_len[i] > 0:
+            out[out_pos] = table_sym[i]
+            nbits -= table_len[i]
+        else:  # 编码长于8位，沿树逐位查找
+            node = 0
+            n = 0  # 该字符包含的比特数
+            while left[node] >= 0:  # 节点有子节点，表示该节点无编码
+                n += 1
+                # 下一位为0，则是左子树上的编码，否则为右子树上的编码
+                node = right[node] if (acc >> (nbits - n)) & 1 else left[node]
+            out[out_pos] = symbol[node]
+            nbits -= n
+        out_pos += 1
+    return pos, out_pos, acc, nbits
 
 
 class Compress:
     """压缩和解压类"""
 
+    BLOCK_SIZE = 64 * 1024
+    """每次编解码的块大小"""
+    BUFFER_SIZE = 1024 * 1024
+    """输出文件的缓冲区大小"""
+    MAX_CODE_LEN = 56
+    """解压时允许的最长编码，保证位缓冲区不超过64位"""
+    MAGIC = b'HUFF'
+    """压缩文件的标识"""
+    HEADER = struct.Struct('<4sQB')
+    """文件头的格式：标识、原文件长度、压缩方式"""
+    MODE_HUFFMAN = 0
+    """文件头中的压缩方式：Huffman编码，其后为各字节的编码长度及编码数据"""
+    MODE_CONST = 1
+    """文件头中的压缩方式：文件只有一种字节，其后仅为该字节"""
+
     @staticmethod
-    def compress(infile, outfile, process_bar):
-        """压缩文件"""
+    def compress(infile, outfile, callback):
+        """压缩文件，callback接收完成的百分比"""
         dic, length = Compress.count(infile)  # 统计字符频率和文件长度
-        pickle.dump(length, outfile)  # 将文件长度写入文件头
+        # 只有一种字节时不必编码，只记录该字节
+        mode = Compress.MODE_CONST if len(dic) == 1 else Compress.MODE_HUFFMAN
+        outfile.write(Compress.HEADER.pack(Compress.MAGIC, length, mode))  # 写入文件头
         if length == 0:
             return
-        # 构造Huffman树，并写入文件头
+        if mode == Compress.MODE_CONST:
+            outfile.write(bytes(dic.keys()))
+            callback(100)
+            return
+        # 构造Huffman树，只将各字节的编码长度写入文件头，解压时据此重建范式Huffman编码
         tree = HuffmanTree(dic)
-        pickle.dump(tree.root, outfile)
-        infile.seek(0)
-        buffer = ''  # 设置缓冲区，达到1字节后写入
-        data = infile.read(16)
-        complete = 0
-        while len(data) != 0:
-            for i in data:
-                buffer += tree.codes[i]
-            while len(buffer) >= 8:
-                outfile.write(bytes([int(buffer[0:8], 2)]))
-                buffer = buffer[8:]
-            complete += len(data)
-            process_bar.setValue(complete * 100 // length)  # 修改进度
-            data = infile.read(16)
+        outfile.write(tree.code_len)
+        acc = 0  # 位缓冲区，存放尚未写出的比特
+        nbits = 0  # 位缓冲区中的比特数
+        # 由字节频次算出压缩后的总比特数，一次分配整个输出缓冲区
+        total_bits = sum(tree.code_len[i] * dic[i] for i in dic)
+        out_buf = bytearray((total_bits + 7) >> 3)
+        out_pos = 0
+        percent = 0  # 已显示的进度，进度变化时才更新进度条
+        with Compress.__map(infile) as data:
+            # 文件在统计后被修改时，输出缓冲区的大小不再可靠
+            if len(data) != length:
+                raise ValueError('文件在压缩过程中被修改')
+            for start in range(0, len(data), Compress.BLOCK_SIZE):
+                with data[start:start + Compress.BLOCK_SIZE] as block:
+                    out_pos, acc, nbits = _encode_kernel(block, tree.code_val, tree.code_len, out_buf, out_pos, acc,
+                                                         nbits)
+                complete = min(start + Compress.BLOCK_SIZE, length)
+                if complete * 100 // length > percent:
+                    percent = complete * 100 // length
+                    callback(percent)  # 修改进度
         # 最后不足8位填充“0”
-        if len(buffer) > 0:
-            outfile.write(bytes([int(buffer + '0' * (8 - len(buffer)), 2)]))
+        if nbits > 0:
+            out_buf[out_pos] = (acc << (8 - nbits)) & 0xFF
+        outfile.write(out_buf)
 
     @staticmethod
     def count(infile):
         """统计字符频率和文件长度"""
-        dic = {}
-        data = infile.read(16)
-        length = 0  # 文件总字节数
-        # 统计字符的频次
-        while len(data) > 0:
-            length += len(data)
-            for i in data:
-                dic[i] = dic.get(i, 0) + 1
-            data = infile.read(16)
+        try:
+            # 将文件映射到内存，一次统计全部字节的频次
+            with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                arr = np.frombuffer(mm, dtype=np.uint8)
+                counts = np.bincount(arr, minlength=256)
+                length = arr.size  # 文件总字节数
+                del arr  # 释放对映射内存的引用，否则无法关闭mmap
+        except (OSError, ValueError):
+            # 无法映射（如空文件或不支持fileno的流）时，分块读取并统计
+            counts = np.zeros(256, dtype=np.int64)
+            length = 0
+            data = infile.read(Compress.BLOCK_SIZE)
+            while len(data) > 0:
+                length += len(data)
+                counts += np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
+                data = infile.read(Compress.BLOCK_SIZE)
+        dic = {i: int(counts[i]) for i in range(256) if counts[i]}
         return dic, length
 
     @staticmethod
-    def decompress(infile, outfile, process_bar):
-        """解压文件"""
-        length = pickle.load(infile)  # 读取原文件长度
+    def decompress(infile, outfile, callback):
+        """解压文件，callback接收完成的百分比"""
+        # 读取文件头，包括标识、原文件长度和压缩方式
+        header = infile.read(Compress.HEADER.size)
+        if len(header) != Compress.HEADER.size:
+            raise ValueError('压缩文件不完整')
+        magic, length, mode = Compress.HEADER.unpack(header)
+        if magic != Compress.MAGIC:
+            raise ValueError('压缩文件错误')
         if length == 0:
-            process_bar.setValue(100)  # 解压完成
+            callback(100)  # 解压完成
             return
-        root = pickle.load(infile)  # 重建Huffman树
-        buffer = ''  # 缓冲区，存放读取但未解压的数据
-        data = infile.read(4)
+        # 只有一种字节时，将该字节重复length次
+        if mode == Compress.MODE_CONST:
+            block = infile.read(1) * min(length, Compress.BUFFER_SIZE)
+            if len(block) == 0:
+                raise ValueError('压缩文件不完整')
+            for start in range(0, length, Compress.BUFFER_SIZE):
+                outfile.write(memoryview(block)[:length - start])
+            callback(100)  # 解压完成
+            return
+        if mode != Compress.MODE_HUFFMAN:
+            raise ValueError('压缩文件错误')
+        # 读取各字节的编码长度，重建范式Huffman编码
+        code_len = array('B', infile.read(256))
+        if len(code_len) != 256:
+            raise ValueError('压缩文件不完整')
+        Compress.__check_codes(code_len)
+        code_val = canonical_codes(code_len)
+        left, right, symbol = build_flat(code_val, code_len)
+        table_sym, table_len, max_len = Compress.__build_table(code_val, code_len)
+        acc = 0  # 位缓冲区，存放读取但未解压的比特
+        nbits = 0  # 位缓冲区中的比特数
+        out_buf = bytearray(length)  # 原文件长度已知，一次分配整个输出缓冲区
+        padded = False  # 是否已在末尾补0
         complete = 0
-        while complete < length:
-            if len(buffer) < 32 and len(data) > 0:
-                for i in data:
-                    buffer += "{:b}".format(i).zfill(8)
-                data = infile.read(4)
-            # 解压缓冲区的第一个字符
-            else:
-                reduce = Compress.__write_byte(buffer, root, outfile)
-                complete += 1
-                process_bar.setValue(complete * 100 // length)  # 修改进度
-                buffer = buffer[reduce:]
+        percent = 0  # 已显示的进度，进度变化时才更新进度条
+        pos = infile.tell()  # 跳过文件头
+        with Compress.__map(infile) as data:
+            while complete < length:
+                # 每次解压一块，不超过原文件剩余的长度
+                end = min(complete + Compress.BLOCK_SIZE, length)
+                pos, complete, acc, nbits = _decode_kernel(data, pos, table_sym, table_len, left, right, symbol,
+                                                           max_len, out_buf, complete, end, acc, nbits)
+                if complete == end:
+                    if complete * 100 // length > percent:
+                        percent = complete * 100 // length
+                        callback(percent)  # 修改进度
+                # 数据读完后补0，保证最后的编码也能取满max_len位查表
+                elif padded:
+                    raise ValueError('压缩文件不完整')
+                else:
+                    data = bytes(max_len // 8 + 1)
+                    pos = 0
+                    padded = True
+        outfile.write(out_buf)
+
+    @staticmethod
+    @contextmanager
+    def __map(infile):
+        """将整个文件映射为只读的memoryview，无法映射时读入全部内容"""
+        try:
+            mm = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            infile.seek(0)
+            yield memoryview(infile.read())
+            return
+        with mm, memoryview(mm) as view:
+            yield view
 
     @staticmethod
-    def __write_byte(buffer: str, root: Node, outfile):
-        """解压并写入缓冲区的第一个字符，返回解压的数据长度"""
-        node = root
-        n = 0  # 该字符包含的比特数
-        # 若根节点无子节点，即只有一种字符，写入该字符
-        if node.is_leaf():
-            n += 1
+    def __check_codes(code_len):
+        """检查编码长度能否构成完整的前缀码（只有一种字节时其编码长度为1）"""
+        lengths = [length for length in code_len if length > 0]
+        if max(lengths, default=0) > Compress.MAX_CODE_LEN:
+            raise ValueError('压缩文件错误')
+        if len(lengths) == 1:
+            if lengths[0] != 1:
+                raise ValueError('压缩文件错误')
+        # Kraft不等式取等号，即每个内部节点都有两个子节点
+        elif len(lengths) == 0 or sum(1 << (max(lengths) - length) for length in lengths) != 1 << max(lengths):
+            raise ValueError('压缩文件错误')
+
+    @staticmethod
+    def __build_table(code_val, code_len):
+        """生成以接下来8位为下标的解码表（字符表和编码长度表）及最长编码长度（至少为8）"""
+        # 若只有一种字符，每个字符占1位
+        if code_len.count(0) == 255:
+            character = next(i for i in range(256) if code_len[i] > 0)
+            return array('B', [character] * 256), array('B', [1] * 256), 8
+        table_sym = array('B', bytes(256))
+        table_len = array('B', bytes(256))  # 编码长于8位的表项长度为0
+        for i in range(256):
+            # 前code_len位等于该编码的所有表项都解码为该字符
+            if 0 < code_len[i] <= 8:
+                shift = 8 - code_len[i]
+                for j in range(code_val[i] << shift, (code_val[i] + 1) << shift):
+                    table_sym[j] = i
+                    table_len[j] = code_len[i]
+        return table_sym, table_len, max(8, max(code_len))
+
+
+class CompressWorker(QObject):
+    """在后台线程中进行压缩或解压的工作类"""
+
+    progress = pyqtSignal(int)
+    """进度变化信号，参数为完成的百分比"""
+    done = pyqtSignal(str)
+    """完成信号，参数为输出文件路径"""
+    error = pyqtSignal(str)
+    """出错信号，参数为错误信息"""
+
+    def __init__(self, option: str, in_path: str, out_path: str):
+        """用操作（压缩或解压）及输入、输出文件路径构造工作对象"""
+        super().__init__()
+        self.option = option
+        self.in_path = in_path
+        self.out_path = out_path
+
+    def run(self):
+        """进行压缩或解压，结束时发出完成或出错信号"""
+        try:
+            with open(self.in_path, 'rb') as infile, \
+                    open(self.out_path, 'wb', buffering=Compress.BUFFER_SIZE) as outfile:
+                if self.option == '压缩':
+                    Compress.compress(infile, outfile, self.progress.emit)
+                else:
+                    Compress.decompress(infile, outfile, self.progress.emit)
+        except ValueError as e:
+            self.error.emit(f'{e}，请检查')
+        except FileNotFoundError:
+            self.error.emit('文件路径有误，请检查')
+        except Exception as e:
+            self.error.emit(repr(e))
         else:
-            while not node.is_leaf():  # 节点有子节点，表示该节点无编码
-                # 下一位为0，则是左子树上的编码，否则为右子树上的编码
-                node = node.left if buffer[n] == '0' else node.right
-                n += 1
-        outfile.write(bytes([node.character]))  # 此时已找到叶节点，写入对应的原字符
-        return n
+            self.done.emit(outfile.name)
 
 
 class HWidget(QWidget):
@@ -260,24 +471,32 @@ class HWidget(QWidget):
         """"点击开始按钮后进行的操作"""
         self.start_button.setEnabled(False)
         self.process_bar.setValue(0)
-        option = self.option_menu.currentText()
-        try:
-            with open(self.in_textedit.text(), 'rb') as infile, open(self.out_textedit.text(), 'wb') as outfile:
-                if option == '压缩':
-                    Compress.compress(infile, outfile, self.process_bar)
-                else:
-                    Compress.decompress(infile, outfile, self.process_bar)
-        # 出错时弹窗提示
-        except pickle.UnpicklingError:
-            QMessageBox.critical(self, '错误', '压缩文件错误，请检查', QMessageBox.Ok)
-        except FileNotFoundError:
-            QMessageBox.critical(self, '错误', '文件路径有误，请检查', QMessageBox.Ok)
-        except Exception as e:
-            QMessageBox.critical(self, '错误', repr(e), QMessageBox.Ok)
-        else:
-            self.process_bar.setValue(100)
-            QMessageBox.information(self, f'{option}完成', f'{option}已完成，{option}文件保存在{outfile.name}',
-                                    QMessageBox.Ok)  # 完成时弹窗提示
+        self.option = self.option_menu.currentText()
+        # 在后台线程中压缩或解压，避免界面卡顿
+        self.work_thread = QThread()
+        self.worker = CompressWorker(self.option, self.in_textedit.text(), self.out_textedit.text())
+        self.worker.moveToThread(self.work_thread)
+        self.work_thread.started.connect(self.worker.run)
+        self.worker.progress.connect(self.process_bar.setValue, Qt.QueuedConnection)
+        self.worker.done.connect(self.__done, Qt.QueuedConnection)
+        self.worker.error.connect(self.__error, Qt.QueuedConnection)
+        self.worker.done.connect(self.work_thread.quit)
+        self.worker.error.connect(self.work_thread.quit)
+        self.work_thread.finished.connect(self.__finished, Qt.QueuedConnection)
+        self.work_thread.start()
+
+    def __done(self, out_path: str):
+        """完成时弹窗提示"""
+        self.process_bar.setValue(100)
+        QMessageBox.information(self, f'{self.option}完成', f'{self.option}已完成，{self.option}文件保存在{out_path}',
+                                QMessageBox.Ok)
+
+    def __error(self, message: str):
+        """出错时弹窗提示"""
+        QMessageBox.critical(self, '错误', message, QMessageBox.Ok)
+
+    def __finished(self):
+        """后台线程结束后允许再次开始"""
         self.start_button.setEnabled(True)
 
     def __select_in(self):